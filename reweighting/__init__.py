@@ -24,6 +24,7 @@
 # *
 # **************************************************************************
 
+import hashlib
 import pwem
 import os
 import pyworkflow.utils as pwutils
@@ -40,10 +41,12 @@ __version__ = "3.0.1"
 class Plugin(pwem.Plugin):
     _supportedVersions = VERSIONS
     _url = REWEIGHTING_URL
+    _activationCmd = None
 
     @classmethod
     def _defineVariables(cls):
         cls._defineVar(REWEIGHTING_ENV_ACTIVATION, DEFAULT_ACTIVATION_CMD)
+        cls._defineVar(REWEIGHTING_GIT_MIRROR, '')
 
     @classmethod
     def getEnviron(cls):
@@ -52,21 +55,34 @@ class Plugin(pwem.Plugin):
 
     @classmethod
     def getReweightingCmd(cls, args):
-        cmd = '%s %s && ' % (cls.getCondaActivationCmd(), cls.getReweightingEnvActivation())
+        cmd = '%s && ' % cls.getActivationCmd()
         cmd += args
         return cmd
 
     @classmethod
     def getActivationCmd(cls):
         """ Return the activation command. """
-        return '%s %s' % (cls.getCondaActivationCmd(),
-                          cls.getReweightingEnvActivation())
+        if cls._activationCmd is None:
+            cls._activationCmd = '%s %s' % (cls.getCondaActivationCmd(),
+                                            cls.getReweightingEnvActivation())
+        return cls._activationCmd
     
     @classmethod
     def getReweightingEnvActivation(cls):
         """ Activate the conda environment. """
         return cls.getVar(REWEIGHTING_ENV_ACTIVATION)
 
+    @classmethod
+    def getGitCloneCmd(cls, url, branch, folder):
+        """ Return a shallow clone command, borrowing objects from
+        the local mirror in REWEIGHTING_GIT_MIRROR when there is one. """
+        cmd = "git clone --depth 1 --single-branch -b %s " % branch
+        mirror = cls.getVar(REWEIGHTING_GIT_MIRROR)
+        if mirror:
+            cmd += "--reference-if-able %s --dissociate " % os.path.join(mirror, os.path.basename(url))
+        cmd += "%s %s" % (url, folder)
+        return cmd
+
     @classmethod
     def isVersionActive(cls):
         return cls.getActiveVersion().startswith(__version__)
@@ -80,42 +96,85 @@ class Plugin(pwem.Plugin):
     @classmethod
     def addReweightingPackage(cls, env, version, default=False):
 
+        def getCondaEnvCreation():
+            # Environments are tagged with the hash of the conda spec, and
+            # packed copies are cached by it, so reinstalls with an unchanged
+            # conda.yaml skip the solve and download
+            ENV_NAME = getReweightingEnvName(version)
+            with open(CONDA_YML, 'rb') as f:
+                specHash = hashlib.sha256(f.read()).hexdigest()
+            cacheDir = os.path.join(pwem.Config.EM_ROOT, ".reweighting-envcache")
+            envCache = os.path.join(cacheDir, specHash + ".tar.gz")
+
+            hashFile = '"$ENV_DIR/.reweighting-spec-hash"'
+            # Conda places named envs in the first writable envs_dirs entry,
+            # which is not always under the base install, so the prefix is
+            # looked up by name. An empty env is registered first if needed
+            # so the lookup matches the env that 'conda activate' will use
+            findEnvCmd = f"conda env list | awk '$1 == \"{ENV_NAME}\" {{print $NF}}'"
+
+            creationCmd = f' ENV_DIR="$({findEnvCmd})" && '
+            creationCmd += 'if [ -z "$ENV_DIR" ]; then '
+            creationCmd += f'conda create -n {ENV_NAME} --yes --quiet && ENV_DIR="$({findEnvCmd})"; fi && '
+            creationCmd += '[ -n "$ENV_DIR" ] && '
+            creationCmd += f'if [ "$(cat {hashFile} 2>/dev/null)" = "{specHash}" ]; then '
+            creationCmd += f'echo "Environment {ENV_NAME} is up to date"; '
+            creationCmd += f"elif [ -f {envCache} ]; then "
+            creationCmd += f'rm -rf "$ENV_DIR" && mkdir -p "$ENV_DIR" && '
+            creationCmd += f'tar -xzf {envCache} -C "$ENV_DIR" && '
+            creationCmd += '"$ENV_DIR/bin/python" "$ENV_DIR/bin/conda-unpack"; '
+            creationCmd += 'else CONDA_FRONTEND="$(command -v mamba || echo conda)" && '
+            creationCmd += 'rm -rf "$ENV_DIR" && '
+            creationCmd += f'"$CONDA_FRONTEND" env create -p "$ENV_DIR" -f {CONDA_YML} --quiet && '
+            creationCmd += f"mkdir -p {cacheDir} && "
+            # pip overwrites some conda-managed files (e.g. setuptools), which
+            # conda-pack would otherwise refuse to pack
+            creationCmd += f'(conda pack -p "$ENV_DIR" -o {envCache} --ignore-missing-files || '
+            creationCmd += f'(rm -f {envCache}; echo "Warning: could not cache environment {ENV_NAME} '
+            creationCmd += 'with conda-pack, it will be solved again on the next install" >&2)); fi && '
+            creationCmd += f"echo {specHash} > {hashFile} && "
+            return creationCmd
+
+        def getConcurrentCmd(cmds):
+            # Run independent commands in the background and fail if any of them fails.
+            # Every command is waited for, so none is left running after a failure
+            concurrentCmd = "{ "
+            for i, cmd in enumerate(cmds):
+                concurrentCmd += "(%s) & PID%d=$!; " % (cmd, i)
+            for i in range(len(cmds)):
+                concurrentCmd += "wait $PID%d; S%d=$?; " % (i, i)
+            concurrentCmd += " && ".join("[ $S%d -eq 0 ]" % i for i in range(len(cmds)))
+            return concurrentCmd + "; } && "
+
         def getCondaInstallationReweighting():
             ENV_NAME = getReweightingEnvName(version)
             installationCmd = cls.getCondaActivationCmd()
-            installationCmd += f" conda env create -n {ENV_NAME} -f {CONDA_YML} --force && "
+            installationCmd += getCondaEnvCreation()
             installationCmd += f"conda activate {ENV_NAME} && "
 
+            cloneCmds = []
             clonePath = os.path.join(pwem.Config.EM_ROOT, "Reweighting")
             if not os.path.exists(clonePath):
-                installationCmd += "git clone -b scipion https://github.com/jamesmkrieger/Ensemble-reweighting-using-Cryo-EM-particles.git Reweighting && "
-
-            installationCmd += "cd Reweighting && "
-            installationCmd += "pip install -Ue . && cd .. && "
-            installationCmd += "python -c 'import cmdstanpy; cmdstanpy.install_cmdstan()' && "
-
-            installationCmd += "touch reweighting_installed"
-            return installationCmd
-
-        def getCondaInstallationTorchSVD():
-            ENV_NAME = getReweightingEnvName(version)
-            installationCmd = cls.getCondaActivationCmd()
-            installationCmd += f"conda activate {ENV_NAME} && "
+                cloneCmds.append(cls.getGitCloneCmd(REWEIGHTING_REPO_URL, "scipion", "Reweighting"))
 
             clonePath = os.path.join(pwem.Config.EM_ROOT, "torch-batch-svd")
             if not os.path.exists(clonePath):
-                installationCmd += "git clone -b master https://github.com/KinglittleQ/torch-batch-svd.git torch-batch-svd && "
-            installationCmd += "cd torch-batch-svd && "
-            installationCmd += "pip install -Ue . && cd .. && "
+                cloneCmds.append(cls.getGitCloneCmd(TORCH_SVD_REPO_URL, "master", "torch-batch-svd"))
+
+            if cloneCmds:
+                installationCmd += getConcurrentCmd(cloneCmds)
+
+            # A single pip run resolves both editable installs together
+            installationCmd += "pip install -U -e ./Reweighting -e ./torch-batch-svd && "
+            installationCmd += "python -c 'import cmdstanpy; cmdstanpy.install_cmdstan()' && "
 
-            installationCmd += "touch reweighting_torch_svd_installed"
+            installationCmd += "touch reweighting_installed reweighting_torch_svd_installed"
             return installationCmd
 
         commands = []
         installationEnv = getCondaInstallationReweighting()
-        installationTorchSVD = getCondaInstallationTorchSVD()
-        commands.append((installationEnv, ["reweighting_installed"]))
-        commands.append((installationTorchSVD, ["reweighting_torch_svd_installed"]))
+        commands.append((installationEnv, ["reweighting_installed",
+                                           "reweighting_torch_svd_installed"]))
 
         env.addPackage('reweighting', version=version,
                        commands=commands,
@@ -26,12 +26,13 @@
 # **************************************************************************
 
 import os
-import reweighting
 
 REWEIGHTING_HOME = 'REWEIGHTING_HOME'
 REWEIGHTING_URL = 'https://github.com/scipion-em/scipion-em-reweighting'
+REWEIGHTING_REPO_URL = 'https://github.com/jamesmkrieger/Ensemble-reweighting-using-Cryo-EM-particles.git'
+TORCH_SVD_REPO_URL = 'https://github.com/KinglittleQ/torch-batch-svd.git'
 
-CONDA_YML = os.path.join(reweighting.__path__[0], 'conda.yaml')
+CONDA_YML = os.path.join(os.path.dirname(__file__), 'conda.yaml')
 
 def getReweightingEnvName(version):
     return "reweighting-%s" % version
@@ -44,8 +45,9 @@ REWEIGHTING_DEFAULT_VER_NUM = V0_0_1
 DEFAULT_ENV_NAME = getReweightingEnvName(REWEIGHTING_DEFAULT_VER_NUM)
 DEFAULT_ACTIVATION_CMD = 'conda activate ' + DEFAULT_ENV_NAME
 REWEIGHTING_ENV_ACTIVATION = 'REWEIGHTING_ENV_ACTIVATION'
+REWEIGHTING_GIT_MIRROR = 'REWEIGHTING_GIT_MIRROR'
 
-REWEIGHTING_SCRIPTS = os.path.join(os.path.dirname(reweighting.__file__), 
+REWEIGHTING_SCRIPTS = os.path.join(os.path.dirname(__file__),
                                    "protocols", "scripts")
 
 REWEIGHTING_MEAN = "_reweightingMean"
@@ -28,14 +28,16 @@ from pyworkflow.object import String
 
 class ReweightingCTF(CTFModel):
 
+    _COPY_ATTRS = ('_defocusU', '_defocusV', '_defocusAngle',
+                   '_defocusRatio', '_psdFile', '_micFile',
+                   '_resolution', '_fitQuality', '_ctfFile')
+
     def __init__(self, **kwargs):
         CTFModel.__init__(self, **kwargs)
         self._ctfFile = String()
    
     def copyInfo(self, other):
-        self.copyAttributes(other, '_defocusU', '_defocusV', '_defocusAngle',
-                            '_defocusRatio', '_psdFile', '_micFile',
-                            '_resolution', '_fitQuality', '_ctfFile')
+        self.copyAttributes(other, *self._COPY_ATTRS)
         if other.hasPhaseShift():
             self.setPhaseShift(other.getPhaseShift())   
 
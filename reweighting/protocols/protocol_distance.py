@@ -32,14 +32,20 @@ This module will provide the image distances program
 import reweighting
 
 import os
+from fnmatch import fnmatch
+from itertools import groupby
 
 from pwem.objects import EMFile
 from pwem.protocols import EMProtocol
 from pyworkflow.protocol import params
 
+from reweighting.constants import REWEIGHTING_SCRIPTS
+
 from subprocess import check_call
 import sys
 
+ROT_MATS_FILENAME = 'rot_mats_struc_image.npy'
+
 class ReweightingImageDistancesProtocol(EMProtocol):
     """
     This protocol will calculate image distances from structures and particles
@@ -131,6 +137,16 @@ class ReweightingImageDistancesProtocol(EMProtocol):
                       display=params.EnumParam.DISPLAY_HLIST,
                       help='hardware device for calculation: "cuda" for GPU, or "cpu" for CPU')
 
+        form.addParam('useTF32', params.BooleanParam, default=False,
+                      label="Use TF32 matrix multiplication?",
+                      condition='device == CUDA',
+                      expertLevel=params.LEVEL_ADVANCED,
+                      help='Allow TensorFloat-32 tensor cores for float32 matrix multiplications '
+                           'on Ampere and newer GPUs. This roughly doubles their throughput, but '
+                           'TF32 keeps only 10 mantissa bits, so the computed image distances change. '
+                           'At low signal-to-noise ratios the rounding can exceed the differences '
+                           'between structures and alter the resulting weights.')
+
         form.addParam('nBatch', params.IntParam, default=10,
                       label="Number of batches",
                       expertLevel=params.LEVEL_ADVANCED,
@@ -206,48 +222,43 @@ class ReweightingImageDistancesProtocol(EMProtocol):
         else:
             trajStructFile = structSystem.getTrajectoryFile()            
 
-        matricesFilename = self._getExtraPath('rot_mats_struc_image.npy')
+        matricesFilename = self._getExtraPath(ROT_MATS_FILENAME)
 
         device = "cpu" if self.device.get() == self.CPU else "cuda"
 
-        params = (topImageFile, trajImageFile, 
-                  topStructFile, trajStructFile,
-                  matricesFilename, self._getExtraPath(),
-                  self.nPixel.get(), self.pixelSize.get(),
-                  self.sigma.get(), self.snr.get(),
-                  self.nBatch.get(), device)
-        
-        command = """python3 -m tools.calc_rot_mats"""
-        args = """--top_image {0} --traj_image {1} --top_struc {2} --traj_struc {3} --outdir {5} \
---n_batch {10}""".format(*params)
-        self.runJob(reweighting.Plugin.getReweightingCmd(command), args)
-
-        command = """python3 -m cryoER.calc_image_struc_distance"""
-        args = """ --top_image {0} --traj_image {1} --top_struc {2} --traj_struc {3} \
---rotmat_struc_imgstruc {4} --outdir {5} --n_pixel {6} --pixel_size {7} --sigma {8} \
---signal_to_noise_ratio {9} --n_batch {10} --device {11}""".format(*params)
-        
-        if self.ctfBool.get():
-            args += " --ctf"
+        options = {'top_image': topImageFile,
+                   'traj_image': trajImageFile,
+                   'top_struc': topStructFile,
+                   'traj_struc': trajStructFile,
+                   'rotmat_struc_imgstruc': matricesFilename,
+                   'outdir': self._getExtraPath(),
+                   'n_pixel': self.nPixel.get(),
+                   'pixel_size': self.pixelSize.get(),
+                   'sigma': self.sigma.get(),
+                   'signal_to_noise_ratio': self.snr.get(),
+                   'n_batch': self.nBatch.get(),
+                   'device': device}
+        flags = {'ctf': self.ctfBool.get(),
+                 'tf32': device == "cuda" and self.useTF32.get()}
+
+        # Both stages run in a single interpreter so the conda environment
+        # is only activated once and heavy imports are shared
+        command = "python3 " + os.path.join(REWEIGHTING_SCRIPTS, "calc_distances.py")
+        args = " ".join("--%s %s" % (key, value) for key, value in options.items())
+        args += "".join(" --%s" % key for key, value in flags.items() if value)
 
         self.runJob(reweighting.Plugin.getReweightingCmd(command), args)
 
     def createOutputStep(self):
-        # register output files
-        self.args = {}
-        filelist = sorted(os.listdir(self._getExtraPath()))[:-1] # exclude rot_mats_struc_image.npy
-
-        oldStart = ''
-        for filename in filelist:
-
-            start = filename.split('_')[0]
-            if start != oldStart:
-                oldStart = start
-                i = 0
-
-            self.args[start + "_file_" + str(i+1)] = EMFile(filename=self._getExtraPath(filename))
-            i += 1
-
+        # register output files, numbered from 1 within each filename prefix
+        with os.scandir(self._getExtraPath()) as entries:
+            filelist = sorted((entry.name, entry.path) for entry in entries
+                              if entry.is_file() and fnmatch(entry.name, '*.npy')
+                              and entry.name != ROT_MATS_FILENAME)
+
+        self.args = {"%s_file_%d" % (start, i): EMFile(filename=path)
+                     for start, group in groupby(filelist, key=lambda f: f[0].split('_')[0])
+                     for i, (_, path) in enumerate(group, 1)}
         self._defineOutputs(**self.args)
 
     # --------------------------- INFO functions -----------------------------------
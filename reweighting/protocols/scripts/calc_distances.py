@@ -0,0 +1,35 @@
+if __name__ == '__main__':
+    import argparse
+    import runpy
+    import sys
+
+    # Input parameters shared with the rotation matrices stage,
+    # everything is forwarded to the image-structure distance stage
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top_image', type=str, required=True)
+    parser.add_argument('--traj_image', type=str, required=True)
+    parser.add_argument('--top_struc', type=str, required=True)
+    parser.add_argument('--traj_struc', type=str, required=True)
+    parser.add_argument('--outdir', type=str, required=True)
+    parser.add_argument('--n_batch', type=int, required=True)
+    parser.add_argument('--tf32', action='store_true')
+
+    args, _ = parser.parse_known_args()
+    distance_argv = [arg for arg in sys.argv[1:] if arg != '--tf32']
+
+    if args.tf32:
+        # Allow TensorFloat-32 tensor cores for float32 matmuls on Ampere and newer GPUs
+        import torch
+        torch.set_float32_matmul_precision('high')
+        torch.backends.cuda.matmul.allow_tf32 = True
+
+    # Run both stages in this interpreter so numpy, torch and MDAnalysis
+    # are only imported and initialised once
+    sys.argv = ['calc_rot_mats',
+                '--top_image', args.top_image, '--traj_image', args.traj_image,
+                '--top_struc', args.top_struc, '--traj_struc', args.traj_struc,
+                '--outdir', args.outdir, '--n_batch', str(args.n_batch)]
+    runpy.run_module('tools.calc_rot_mats', run_name='__main__', alter_sys=True)
+
+    sys.argv = ['calc_image_struc_distance'] + distance_argv
+    runpy.run_module('cryoER.calc_image_struc_distance', run_name='__main__', alter_sys=True)
@@ -0,0 +1,26 @@
+if __name__ == '__main__':
+    import argparse
+    import runpy
+    import sys
+
+    # Input parameters needed for the analysis and the list of image
+    # distance files, everything else is forwarded to the MCMC sampling
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--infileclustersize', type=str, required=True)
+    parser.add_argument('--infileimagedistance_list', type=str, required=True)
+    parser.add_argument('--outdir', type=str, required=True)
+
+    args, mcmc_argv = parser.parse_known_args()
+
+    with open(args.infileimagedistance_list) as f:
+        image_distance_files = [line.rstrip('\n') for line in f if line.strip()]
+
+    # Sample and analyse in this interpreter so numpy, cmdstanpy and
+    # cryoER are only imported once
+    sys.argv = (['run_cryoER_mcmc', '--infileclustersize', args.infileclustersize,
+                 '--infileimagedistance'] + image_distance_files +
+                ['--outdir', args.outdir] + mcmc_argv)
+    runpy.run_module('cryoER.run_cryoER_mcmc', run_name='__main__', alter_sys=True)
+
+    from analyse import analyse
+    analyse(args.outdir, args.infileclustersize)
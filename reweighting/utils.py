@@ -0,0 +1,62 @@
+# **************************************************************************
+# *
+# * Authors:     James Krieger (jmkrieger@cnb.csic.es)
+# *
+# * Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sqlite3
+from contextlib import closing
+from urllib.request import pathname2url
+
+import numpy as np
+
+
+def getColumnValues(itemSet, attrName):
+    """ Return a float array with the value of attrName for every item
+    of itemSet, read in one query from the sqlite file behind the set. """
+    n = len(itemSet)
+    # Sets sharing a file (e.g. classes) keep their tables under a prefix,
+    # normalised the same way as pyworkflow's SqliteFlatDb does
+    mapperPath = itemSet._mapperPath
+    prefix = mapperPath[1].strip() if len(mapperPath) > 1 else ''
+    if prefix and not prefix.endswith('_'):
+        prefix += '_'
+    try:
+        uri = 'file:%s?mode=ro' % pathname2url(os.path.abspath(itemSet.getFileName()))
+        with closing(sqlite3.connect(uri, uri=True)) as conn:
+            row = conn.execute("SELECT column_name FROM %sClasses WHERE label_property=?"
+                               % prefix, (attrName,)).fetchone()
+            count, = conn.execute("SELECT COUNT(*) FROM %sObjects" % prefix).fetchone()
+            if row is not None and count == n:
+                cursor = conn.execute("SELECT %s FROM %sObjects ORDER BY id"
+                                      % (row[0], prefix))
+                return np.fromiter((value for value, in cursor),
+                                   dtype=np.float64, count=n)
+    except (sqlite3.Error, TypeError, ValueError):
+        pass
+
+    # Fall back to iterating the set if the column cannot be read directly,
+    # or if the table rows do not match the items of the set (e.g. a subset)
+    return np.fromiter((getattr(item, attrName).get() for item in itemSet),
+                       dtype=np.float64, count=n)
@@ -40,6 +40,8 @@ from pyworkflow.viewer import ProtocolViewer, DESKTOP_TKINTER, WEB_DJANGO
 
 from xmipp3.protocols.protocol_compute_likelihood import XmippProtComputeLikelihood
 
+from reweighting.utils import getColumnValues
+
 _invalidInputStr = 'Invalid input'
 
 class ReweightingLLViewer(ProtocolViewer):
@@ -100,7 +102,7 @@ class ReweightingLLViewer(ProtocolViewer):
         
         filename = self.protocol._getExtraPath('matrix.npy')
         if not os.path.exists(filename):
-            matrix = np.array([particle._xmipp_logLikelihood.get() for particle in self.outputs])
+            matrix = getColumnValues(self.outputs, '_xmipp_logLikelihood')
             matrix = matrix.reshape((len(self.refs),-1))
             np.save(filename, matrix)
         else:
@@ -38,6 +38,7 @@ setup(
     install_requires=[requirements],
     entry_points={'pyworkflow.plugin': 'reweighting = reweighting'},
     package_data={  # Optional
-       'reweighting': ['icon.png', 'protocols.conf'],
+       'reweighting': ['icon.png', 'protocols.conf', 'conda.yaml',
+                       'protocols/scripts/*.py'],
     }
 )